@@ -9,8 +9,22 @@ DATABASE_URL = os.getenv("DATABASE_URL")
 if not DATABASE_URL:
     raise ValueError("DATABASE_URL environment variable not set.")
 
+# Size of the shared PostgreSQL connection pool used by database.py.
+# psycopg2 closes a returned connection once minconn idle connections are held, so minconn must
+# cover the threads that use the database at the same time (Q&A thread, main.py's db-write
+# worker, the usage-count flush timer); otherwise overlapping calls reconnect and lose their
+# per-connection prepared statements.
+DB_POOL_MIN_CONN = int(os.getenv("DB_POOL_MIN_CONN", "3"))
+DB_POOL_MAX_CONN = int(os.getenv("DB_POOL_MAX_CONN", "20"))
+
+# Maximum number of web pages fetched at the same time (size of main.py's fetch thread pool)
+MAX_CONCURRENT_FETCHES = int(os.getenv("MAX_CONCURRENT_FETCHES", "4"))
+
 # Example for an AI API key
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY") # You'll set this in Railway's environment variables
 
+# How long an identical OpenAI chat request may be answered from LLMResponseCache
+LLM_CACHE_TTL_SECONDS = int(os.getenv("LLM_CACHE_TTL_SECONDS", str(6 * 3600)))
+
 # The OFFICIAL_SOURCES_CONFIG dictionary has been removed as it's no longer used.
 # database.py now reads sources directly from the UK_Government_Finance_and_Tax_Websites.csv file.
\ No newline at end of file
@@ -1,145 +1,413 @@
 # database.py
+import atexit
+import functools
+import logging
+import os
+import threading
+import time
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+
 import psycopg2
+import psycopg2.extensions
 import psycopg2.extras 
-from psycopg2 import sql
-import config # For DATABASE_URL
-from datetime import datetime
+import psycopg2.pool
+import config # For DATABASE_URL and pool sizing
 import json # For potential JSONB operations if any were kept (not in this simplified schema)
 
-def get_db_connection():
-    """Establishes a connection to the PostgreSQL database."""
+logger = logging.getLogger(__name__)
+
+_SCHEMA_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'schema.sql')
+
+_pool = None
+_pool_lock = threading.Lock()
+
+# Short-lived cache of search_stored_enquiries results, keyed by (keywords, verified_only).
+_SEARCH_CACHE_TTL_SECONDS = 60
+_SEARCH_CACHE_MAXSIZE = 1024
+_search_cache = OrderedDict()
+_search_cache_lock = threading.Lock()
+
+# Server-side prepared statements, PREPAREd lazily once per pooled connection.
+# Keyword search uses array overlap (&&); the verified query is served by the partial GIN index.
+_PREPARED_STATEMENTS = {
+    "search_verified": """
+        PREPARE search_verified(text[]) AS
+        SELECT id, question_text, ai_generated_information, ai_identified_urls, usage_count
+        FROM UserEnquiries
+        WHERE is_verified = TRUE AND keywords && $1
+        ORDER BY usage_count DESC, timestamp_asked DESC LIMIT 5
+    """,
+    "search_all": """
+        PREPARE search_all(text[]) AS
+        SELECT id, question_text, ai_generated_information, ai_identified_urls, usage_count
+        FROM UserEnquiries
+        WHERE keywords && $1
+        ORDER BY usage_count DESC, timestamp_asked DESC LIMIT 5
+    """,
+    "ins_enquiry": """
+        PREPARE ins_enquiry(text, text[], text, text[], text, text, boolean, real[]) AS
+        INSERT INTO UserEnquiries (question_text, keywords, ai_generated_information,
+                                   ai_identified_urls, fetched_content_summary,
+                                   source_of_answer, is_verified, usage_count, question_embedding)
+        VALUES ($1, $2, $3, $4, $5, $6, $7, 0, $8) RETURNING id
+    """,
+    "upd_enquiry": """
+        PREPARE upd_enquiry(text, text[], text, text[], text, text, boolean, int) AS
+        UPDATE UserEnquiries
+        SET question_text = $1, keywords = $2, ai_generated_information = $3,
+            ai_identified_urls = $4, fetched_content_summary = $5,
+            source_of_answer = $6, is_verified = $7
+        WHERE id = $8
+          AND (question_text, keywords, ai_generated_information, ai_identified_urls,
+               fetched_content_summary, source_of_answer, is_verified)
+              IS DISTINCT FROM ($1, $2, $3, $4, $5, $6, $7)
+    """,
+    "enquiry_embeddings_since": """
+        PREPARE enquiry_embeddings_since(int) AS
+        SELECT id, question_text, ai_generated_information, ai_identified_urls,
+               fetched_content_summary, is_verified, question_embedding
+        FROM UserEnquiries
+        WHERE id > $1 AND question_embedding IS NOT NULL
+          AND (is_verified = TRUE OR fetched_content_summary IS NOT NULL)
+        ORDER BY id
+    """,
+    "enquiry_embeddings_by_id": """
+        PREPARE enquiry_embeddings_by_id(int[]) AS
+        SELECT id, question_text, ai_generated_information, ai_identified_urls,
+               fetched_content_summary, is_verified, question_embedding
+        FROM UserEnquiries
+        WHERE id = ANY($1) AND question_embedding IS NOT NULL
+    """,
+    "verified_embedding_ids": """
+        PREPARE verified_embedding_ids AS
+        SELECT id FROM UserEnquiries
+        WHERE is_verified = TRUE AND question_embedding IS NOT NULL
+    """,
+    "get_llm_response": """
+        PREPARE get_llm_response(text, double precision) AS
+        SELECT response_content FROM LLMResponseCache
+        WHERE cache_key = $1 AND created_at > CURRENT_TIMESTAMP - make_interval(secs => $2)
+    """,
+    "put_llm_response": """
+        PREPARE put_llm_response(text, text) AS
+        INSERT INTO LLMResponseCache (cache_key, response_content) VALUES ($1, $2)
+        ON CONFLICT (cache_key) DO UPDATE
+        SET response_content = EXCLUDED.response_content, created_at = CURRENT_TIMESTAMP
+    """,
+    "purge_llm_responses": """
+        PREPARE purge_llm_responses(double precision) AS
+        DELETE FROM LLMResponseCache
+        WHERE created_at < CURRENT_TIMESTAMP - make_interval(secs => $1)
+    """,
+    "inc_usage": """
+        PREPARE inc_usage(int[], int[]) AS
+        UPDATE UserEnquiries AS e SET usage_count = e.usage_count + t.increment
+        FROM unnest($1, $2) AS t(id, increment)
+        WHERE e.id = t.id
+    """,
+}
+
+# Expired LLMResponseCache rows are deleted at startup and every N stores.
+_LLM_CACHE_PURGE_EVERY_N_STORES = 100
+_llm_cache_stores_since_purge = 0
+_llm_cache_purge_lock = threading.Lock()
+
+# usage_count increments are buffered in-process and written in one UPDATE per flush.
+_USAGE_FLUSH_INTERVAL_SECONDS = 5
+_USAGE_FLUSH_MAX_PENDING = 100
+_pending_usage = Counter()
+_pending_usage_lock = threading.Lock()
+_usage_flush_timer = None
+
+class _PooledConnection(psycopg2.extensions.connection):
+    """
+    Autocommit connection that remembers which server-side prepared statements it holds.
+    Every helper here issues a single statement, so autocommit avoids a BEGIN/COMMIT
+    pair per call; wrap multi-statement work in `with conn:` to get one transaction.
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.autocommit = True
+        self.prepared_statements = set()
+
+def _get_pool():
+    """Returns the shared connection pool, creating it on first use."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                try:
+                    _pool = psycopg2.pool.ThreadedConnectionPool(
+                        config.DB_POOL_MIN_CONN, config.DB_POOL_MAX_CONN, dsn=config.DATABASE_URL,
+                        connection_factory=_PooledConnection)
+                except psycopg2.Error as e:
+                    logger.error("Error connecting to PostgreSQL database: %s", e)
+                    raise
+    return _pool
+
+def _shutdown():
+    """Flushes buffered writes, then closes the pool (registered with atexit)."""
+    flush_usage_counts()
+    if _pool is not None:
+        _pool.closeall()
+
+@contextmanager
+def db_conn():
+    """
+    Borrows an autocommit connection from the shared pool and hands it back on exit.
+    Typical use is `with db_conn() as conn, conn.cursor() as cur:`.
+    """
+    pool = _get_pool()
+    conn = pool.getconn()
     try:
-        conn = psycopg2.connect(config.DATABASE_URL)
-        return conn
-    except psycopg2.Error as e:
-        print(f"Error connecting to PostgreSQL database: {e}")
-        raise
+        yield conn
+    finally:
+        pool.putconn(conn)
+
+def _execute_prepared(cur, name, params):
+    """Runs a statement from _PREPARED_STATEMENTS, preparing it on this connection first if needed."""
+    conn = cur.connection
+    if name not in conn.prepared_statements:
+        cur.execute(_PREPARED_STATEMENTS[name])
+        conn.prepared_statements.add(name)
+    if not params:
+        cur.execute(f"EXECUTE {name}")
+        return
+    placeholders = ", ".join(["%s"] * len(params))
+    cur.execute(f"EXECUTE {name}({placeholders})", params)
+
+def invalidate_search_cache(verified_only=None):
+    """
+    Drops cached search results. With verified_only=None everything is dropped,
+    otherwise only entries cached for that verified_only value.
+    """
+    with _search_cache_lock:
+        if verified_only is None:
+            _search_cache.clear()
+        else:
+            for key in [k for k in _search_cache if k[1] == verified_only]:
+                del _search_cache[key]
+
+def _get_cached_search(cache_key):
+    with _search_cache_lock:
+        entry = _search_cache.get(cache_key)
+        if entry is None:
+            return None
+        cached_at, rows = entry
+        if time.monotonic() - cached_at >= _SEARCH_CACHE_TTL_SECONDS:
+            del _search_cache[cache_key]
+            return None
+        _search_cache.move_to_end(cache_key)
+        return [dict(row) for row in rows]
+
+def _store_cached_search(cache_key, rows):
+    with _search_cache_lock:
+        _search_cache[cache_key] = (time.monotonic(), rows)
+        _search_cache.move_to_end(cache_key)
+        while len(_search_cache) > _SEARCH_CACHE_MAXSIZE:
+            _search_cache.popitem(last=False)
+
+def _normalize_keywords(keywords):
+    """
+    Lowercases and de-duplicates keywords (keeping first-seen order) so stored and
+    searched arrays compare consistently and carry no repeated elements.
+    """
+    if not keywords:
+        return keywords
+    return list(dict.fromkeys(kw.strip().lower() for kw in keywords if kw and kw.strip()))
+
+@functools.lru_cache(maxsize=1)
+def _load_schema_sql():
+    """Reads schema.sql (next to this module) once per process."""
+    with open(_SCHEMA_PATH, 'r') as f:
+        return f.read()
 
 def execute_schema():
-    """Executes the schema.sql file to create tables/apply alterations."""
-    conn = None
+    """
+    Executes the schema.sql file to create tables/apply alterations.
+    Every statement in it is idempotent (IF NOT EXISTS), so it is safe to run on each start.
+    """
     try:
-        conn = get_db_connection()
-        cur = conn.cursor()
-        with open('schema.sql', 'r') as f:
-            sql_script = f.read()
+        sql_script = _load_schema_sql()
+        with db_conn() as conn, conn.cursor() as cur:
             cur.execute(sql_script) 
-        conn.commit()
-        print("Database schema executed successfully.")
+        logger.info("Database schema executed successfully.")
     except FileNotFoundError:
-        print("schema.sql not found. Please ensure it's in the correct location.")
+        logger.error("schema.sql not found at %s. Please ensure it's in the correct location.", _SCHEMA_PATH)
     except psycopg2.Error as e:
-        print(f"Error executing schema: {e}")
-    finally:
-        if conn:
-            if 'cur' in locals() and not cur.closed: cur.close()
-            conn.close()
+        logger.exception("Error executing schema: %s", e)
 
 def add_or_update_user_enquiry(question_text, keywords=None, ai_generated_information=None, 
                                ai_identified_urls=None, fetched_content_summary=None, 
-                               source_of_answer=None, is_verified=False, enquiry_id=None):
-    """Adds a new user enquiry or updates an existing one. Returns the enquiry ID."""
-    conn = None
+                               source_of_answer=None, is_verified=False, enquiry_id=None,
+                               question_embedding=None):
+    """
+    Adds a new user enquiry or updates an existing one. Returns the enquiry ID.
+    question_embedding is only written on insert; updates keep the stored embedding.
+    """
+    keywords = _normalize_keywords(keywords)
     try:
-        conn = get_db_connection()
-        cur = conn.cursor()
-        
-        if enquiry_id: # Update existing
-            # For simplicity, this example just updates all fields.
-            # You might want more granular updates.
-            cur.execute("""
-                UPDATE UserEnquiries 
-                SET question_text = %s, keywords = %s, ai_generated_information = %s, 
-                    ai_identified_urls = %s, fetched_content_summary = %s, 
-                    source_of_answer = %s, is_verified = %s 
-                WHERE id = %s
-            """, (question_text, keywords, ai_generated_information, ai_identified_urls, 
-                  fetched_content_summary, source_of_answer, is_verified, enquiry_id))
-            print(f"User enquiry ID {enquiry_id} updated.")
-        else: # Insert new
-            cur.execute("""
-                INSERT INTO UserEnquiries (question_text, keywords, ai_generated_information, 
-                                           ai_identified_urls, fetched_content_summary, 
-                                           source_of_answer, is_verified, timestamp_asked, usage_count)
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, 0) RETURNING id;
-            """, (question_text, keywords, ai_generated_information, ai_identified_urls, 
-                  fetched_content_summary, source_of_answer, is_verified, datetime.now()))
-            enquiry_id = cur.fetchone()[0]
-            print(f"New user enquiry added with ID: {enquiry_id}")
-        
-        conn.commit()
-        return enquiry_id
+        with db_conn() as conn, conn.cursor() as cur:
+            if enquiry_id: # Update existing
+                # For simplicity, this example just updates all fields.
+                # You might want more granular updates.
+                # Rows whose values are unchanged are skipped (no new row version, no WAL).
+                _execute_prepared(cur, "upd_enquiry", (question_text, keywords, ai_generated_information, ai_identified_urls, 
+                                                       fetched_content_summary, source_of_answer, is_verified, enquiry_id))
+                changed = cur.rowcount > 0
+                logger.debug("User enquiry ID %s %s.", enquiry_id, "updated" if changed else "unchanged")
+            else: # Insert new
+                # timestamp_asked is filled in by the column default (CURRENT_TIMESTAMP).
+                _execute_prepared(cur, "ins_enquiry", (question_text, keywords, ai_generated_information, ai_identified_urls, 
+                                                       fetched_content_summary, source_of_answer, is_verified, question_embedding))
+                enquiry_id = cur.fetchone()[0]
+                logger.debug("New user enquiry added with ID: %s", enquiry_id)
+                changed = True
     except psycopg2.Error as e:
-        print(f"Error adding/updating user enquiry for question '{question_text[:50]}...': {e}")
-        if conn: conn.rollback()
+        logger.exception("Error adding/updating user enquiry for question '%s...': %s", question_text[:50], e)
         return None
-    finally:
-        if conn:
-            if 'cur' in locals() and not cur.closed: cur.close()
-            conn.close()
+    if changed:
+        # Verified answers feed every search; other writes only affect unverified searches.
+        invalidate_search_cache(None if is_verified else False)
+    return enquiry_id
 
 def search_stored_enquiries(keywords: list, verified_only=True):
     """
     Searches the UserEnquiries table for verified answers matching keywords.
     Returns a list of matching (id, question_text, ai_generated_information, ai_identified_urls) dicts.
+    Results are cached briefly in-process, so repeated questions skip the database.
     """
+    keywords = _normalize_keywords(keywords)
     if not keywords:
         return []
-    conn = None
+    cache_key = (tuple(sorted(set(keywords))), verified_only)
+    cached_rows = _get_cached_search(cache_key)
+    if cached_rows is not None:
+        return cached_rows
     try:
-        conn = get_db_connection()
-        cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-        
-        # Search based on keywords array overlap (&&) or question_text ILIKE
-        # This query can be refined for better relevance.
-        conditions = []
-        params = []
-
-        # Condition for keywords array overlap
-        # Ensure keywords are stored consistently (e.g., all lowercase)
-        # This expects keywords in the DB to be an array of text.
-        conditions.append(sql.SQL("keywords && %s")) 
-        params.append(keywords)
-
-        # Optionally add ILIKE conditions for question_text
-        # for kw_pattern in [f"%{kw}%" for kw in keywords]:
-        #     conditions.append(sql.SQL("question_text ILIKE %s"))
-        #     params.append(kw_pattern)
-
-        base_query_select = sql.SQL("SELECT id, question_text, ai_generated_information, ai_identified_urls, usage_count FROM UserEnquiries WHERE ")
-        if verified_only:
-            base_query_where = sql.SQL("is_verified = TRUE AND (")
-        else:
-            base_query_where = sql.SQL("(") # Or remove is_verified from WHERE if not needed for unverified search
-
-        if not conditions: # Should not happen if keywords are present
-             return []
+        # RealDictCursor rows are already dicts, so no per-row conversion is needed.
+        with db_conn() as conn, conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
+            _execute_prepared(cur, "search_verified" if verified_only else "search_all", (keywords,))
+            results = cur.fetchall()
+    except psycopg2.Error as e:
+        logger.exception("Error searching stored enquiries: %s", e)
+        return []
+    _store_cached_search(cache_key, results)
+    return [dict(row) for row in results]
 
-        query_sql = base_query_select + base_query_where + sql.SQL(" OR ").join(conditions) + sql.SQL(") ORDER BY usage_count DESC, timestamp_asked DESC LIMIT 5;")
-        
-        cur.execute(query_sql, params)
-        results = cur.fetchall()
-        return [dict(row) for row in results]
+def get_enquiry_embeddings(after_id=0, enquiry_ids=None):
+    """
+    Returns enquiries that have a stored question embedding, as dicts with id, question_text,
+    ai_generated_information, ai_identified_urls, fetched_content_summary, is_verified and
+    question_embedding. By default these are the enquiries with id > after_id that are either
+    verified or carry fetched content, in id order; with enquiry_ids, exactly those enquiries.
+    """
+    try:
+        with db_conn() as conn, conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
+            if enquiry_ids is not None:
+                _execute_prepared(cur, "enquiry_embeddings_by_id", (list(enquiry_ids),))
+            else:
+                _execute_prepared(cur, "enquiry_embeddings_since", (after_id,))
+            return cur.fetchall()
     except psycopg2.Error as e:
-        print(f"Error searching stored enquiries: {e}")
+        logger.exception("Error loading enquiry embeddings: %s", e)
         return []
-    finally:
-        if conn:
-            if 'cur' in locals() and not cur.closed: cur.close()
-            conn.close()
+
+def get_verified_embedding_ids():
+    """Returns the set of ids of verified enquiries that have a stored question embedding."""
+    try:
+        with db_conn() as conn, conn.cursor() as cur:
+            _execute_prepared(cur, "verified_embedding_ids", ())
+            return {row[0] for row in cur.fetchall()}
+    except psycopg2.Error as e:
+        logger.exception("Error loading verified enquiry ids: %s", e)
+        return set()
+
+def get_cached_llm_response(cache_key, max_age_seconds):
+    """Returns the stored completion text for cache_key if younger than max_age_seconds, else None."""
+    try:
+        with db_conn() as conn, conn.cursor() as cur:
+            _execute_prepared(cur, "get_llm_response", (cache_key, max_age_seconds))
+            row = cur.fetchone()
+    except psycopg2.Error as e:
+        logger.exception("Error reading cached LLM response: %s", e)
+        return None
+    return row[0] if row else None
+
+def store_llm_response(cache_key, response_content):
+    """
+    Stores (or refreshes) the completion text for cache_key. Every
+    _LLM_CACHE_PURGE_EVERY_N_STORES stores, expired entries are deleted.
+    """
+    global _llm_cache_stores_since_purge
+    try:
+        with db_conn() as conn, conn.cursor() as cur:
+            _execute_prepared(cur, "put_llm_response", (cache_key, response_content))
+    except psycopg2.Error as e:
+        logger.exception("Error storing LLM response in cache: %s", e)
+        return
+    with _llm_cache_purge_lock:
+        _llm_cache_stores_since_purge += 1
+        purge_now = _llm_cache_stores_since_purge >= _LLM_CACHE_PURGE_EVERY_N_STORES
+        if purge_now:
+            _llm_cache_stores_since_purge = 0
+    if purge_now:
+        purge_expired_llm_responses()
+
+def purge_expired_llm_responses(max_age_seconds=None):
+    """Deletes LLMResponseCache entries older than max_age_seconds (default config.LLM_CACHE_TTL_SECONDS)."""
+    if max_age_seconds is None:
+        max_age_seconds = config.LLM_CACHE_TTL_SECONDS
+    try:
+        with db_conn() as conn, conn.cursor() as cur:
+            _execute_prepared(cur, "purge_llm_responses", (max_age_seconds,))
+            logger.info("Purged %s expired LLM cache entries.", cur.rowcount)
+    except psycopg2.Error as e:
+        logger.exception("Error purging expired LLM responses: %s", e)
+
+def _start_usage_flush_timer():
+    """Schedules flush_usage_counts() unless one is already scheduled. Caller holds _pending_usage_lock."""
+    global _usage_flush_timer
+    if _usage_flush_timer is None:
+        _usage_flush_timer = threading.Timer(_USAGE_FLUSH_INTERVAL_SECONDS, flush_usage_counts)
+        _usage_flush_timer.daemon = True
+        _usage_flush_timer.start()
 
 def increment_enquiry_usage_count(enquiry_id):
-    """Increments the usage_count for a specific stored enquiry."""
-    conn = None
+    """
+    Records a usage_count increment for a stored enquiry. Increments are buffered and
+    written together by flush_usage_counts(), either after a short delay or once
+    enough are pending.
+    """
+    with _pending_usage_lock:
+        _pending_usage[enquiry_id] += 1
+        flush_now = sum(_pending_usage.values()) >= _USAGE_FLUSH_MAX_PENDING
+        if not flush_now:
+            _start_usage_flush_timer()
+    if flush_now:
+        flush_usage_counts()
+
+def flush_usage_counts():
+    """Writes all buffered usage_count increments in a single UPDATE."""
+    global _usage_flush_timer
+    with _pending_usage_lock:
+        if _usage_flush_timer is not None:
+            _usage_flush_timer.cancel()
+            _usage_flush_timer = None
+        pending = dict(_pending_usage)
+        _pending_usage.clear()
+    if not pending:
+        return
+    enquiry_ids = list(pending)
     try:
-        conn = get_db_connection()
-        cur = conn.cursor()
-        cur.execute("UPDATE UserEnquiries SET usage_count = usage_count + 1 WHERE id = %s;", (enquiry_id,))
-        conn.commit()
+        with db_conn() as conn, conn.cursor() as cur:
+            _execute_prepared(cur, "inc_usage", (enquiry_ids, [pending[i] for i in enquiry_ids]))
     except psycopg2.Error as e:
-        print(f"Error incrementing usage count for enquiry ID {enquiry_id}: {e}")
-        if conn: conn.rollback()
-    finally:
-        if conn:
-            if 'cur' in locals() and not cur.closed: cur.close()
-            conn.close()
\ No newline at end of file
+        logger.exception("Error incrementing usage count for enquiry IDs %s: %s", enquiry_ids, e)
+        # Keep the increments and schedule a retry, even if no further cache hits arrive.
+        with _pending_usage_lock:
+            _pending_usage.update(pending)
+            _start_usage_flush_timer()
+
+atexit.register(_shutdown)
@@ -1,58 +1,416 @@
 # main.py
+import atexit
+import hashlib
 import requests
-from bs4 import BeautifulSoup # For basic HTML cleaning in fetch_web_content
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from bs4 import BeautifulSoup # For basic HTML cleaning in fetch_web_content (lxml parser)
 import time
-from datetime import datetime
 import json
+import logging
+import re
+import sys
+import threading
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit, urlunsplit
+import numpy as np
+import tiktoken
 
 import database # Your database module (as updated in Turn 48)
 import config   # For API keys and DB URL (as updated in Turn 45)
 
 from openai import OpenAI # Import the OpenAI library
 
+logger = logging.getLogger(__name__)
+
+# Shared HTTP session: keep-alive connections are reused across fetches, and
+# transient server errors / rate limits are retried with backoff.
+_SESSION = requests.Session()
+_SESSION.headers.update({
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36 FinAdviceBot/2.0'
+})
+_HTTP_ADAPTER = HTTPAdapter(
+    pool_connections=20, pool_maxsize=50,
+    max_retries=Retry(total=2, backoff_factor=0.3, status_forcelist=[429, 500, 502, 503, 504], raise_on_status=False)
+)
+_SESSION.mount('http://', _HTTP_ADAPTER)
+_SESSION.mount('https://', _HTTP_ADAPTER)
+atexit.register(_SESSION.close)
+
+# Cleaned text of fetched pages: url -> {etag, last_modified, text, fetched_at}, least recently
+# used first. Pages fetched within PAGE_CACHE_FRESH_SECONDS are served without a request; older
+# ones are revalidated with a conditional GET when the server gave us validators.
+PAGE_CACHE_FRESH_SECONDS = 24 * 3600
+PAGE_CACHE_MAXSIZE = 256
+_page_cache = OrderedDict()
+_page_cache_lock = threading.Lock()
+_page_cache_stats = Counter() # hits, revalidated, misses
+
+def page_cache_info():
+    """Returns hit/revalidated/miss counts and the current size of the page cache."""
+    with _page_cache_lock:
+        return {'hits': _page_cache_stats['hits'], 'revalidated': _page_cache_stats['revalidated'],
+                'misses': _page_cache_stats['misses'], 'size': len(_page_cache), 'maxsize': PAGE_CACHE_MAXSIZE}
+
+# Common non-content tags removed before extracting a page's text
+_STRIP_TAGS = ("script", "style", "header", "footer", "nav", "aside")
+
+# Only this much of a page is downloaded and parsed; the extracted text is cut to 15000
+# characters anyway, so the rest of a very large page would be thrown away.
+MAX_FETCH_BYTES = 1024 * 1024
+
+def _read_capped_body(response):
+    """Reads a streamed response body, stopping after MAX_FETCH_BYTES."""
+    body = bytearray()
+    for chunk in response.iter_content(65536):
+        body.extend(chunk)
+        if len(body) >= MAX_FETCH_BYTES:
+            logger.info("Stopped reading %s after %d bytes.", response.url, len(body))
+            break
+    return bytes(body[:MAX_FETCH_BYTES])
+
 def fetch_web_content(url, source_name="identified_source"):
     """ 
     Fetches web content from the given URL and extracts clean text.
     Limits content length to manage token usage.
+    The body is streamed, so non-text responses are dropped without being downloaded
+    and only the first MAX_FETCH_BYTES of a large page are read. Recently fetched pages are
+    served from _page_cache; older ones are revalidated with If-None-Match /
+    If-Modified-Since, and a 304 reuses the previously cleaned text.
     """
-    print(f"[{datetime.now()}] Fetching content from URL: {url}")
+    logger.info("Fetching content from URL: %s", url)
+    with _page_cache_lock:
+        cached_page = _page_cache.get(url)
+        if cached_page:
+            _page_cache.move_to_end(url)
+            if time.monotonic() - cached_page['fetched_at'] < PAGE_CACHE_FRESH_SECONDS:
+                _page_cache_stats['hits'] += 1
+                logger.info("Using cached text for %s.", url)
+                return cached_page['text']
+    conditional_headers = {}
+    if cached_page:
+        if cached_page['etag']:
+            conditional_headers['If-None-Match'] = cached_page['etag']
+        if cached_page['last_modified']:
+            conditional_headers['If-Modified-Since'] = cached_page['last_modified']
     try:
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36 FinAdviceBot/2.0'
-        }
-        response = requests.get(url, timeout=15, headers=headers)
-        response.raise_for_status() 
-        
-        content_type = response.headers.get('content-type', '').lower()
-        if 'text/html' in content_type or 'text/plain' in content_type or not content_type:
-            soup = BeautifulSoup(response.text, 'html.parser')
-            for script_or_style in soup(["script", "style", "header", "footer", "nav", "aside"]): # Remove common non-content tags
+        with _SESSION.get(url, timeout=15, stream=True, headers=conditional_headers) as response:
+            if response.status_code == 304 and cached_page:
+                logger.info("%s not modified since last fetch; reusing cached text.", url)
+                with _page_cache_lock:
+                    cached_page['fetched_at'] = time.monotonic()
+                    _page_cache_stats['revalidated'] += 1
+                return cached_page['text']
+            response.raise_for_status() 
+            
+            content_type = response.headers.get('content-type', '').lower()
+            if not ('text/html' in content_type or 'text/plain' in content_type or not content_type):
+                logger.warning("Content type for %s is '%s'. Returning None.", url, content_type)
+                return None 
+            body = _read_capped_body(response)
+            html = body.decode(response.encoding or 'utf-8', errors='replace')
+            etag = response.headers.get('ETag')
+            last_modified = response.headers.get('Last-Modified')
+
+        if html:
+            soup = BeautifulSoup(html, 'lxml')
+            for script_or_style in soup(_STRIP_TAGS):
                 script_or_style.decompose()
             text = soup.get_text(separator=' ', strip=True)
             # Further clean up multiple newlines or excessive whitespace if needed
             text = ' '.join(text.split())
-            print(f"[{datetime.now()}] Fetched and cleaned text from {url} (length: {len(text)})")
-            return text[:15000] # Limit content length to manage token usage (approx 4000-5000 tokens)
-        else:
-            print(f"[{datetime.now()}] Warning: Content type for {url} is '{content_type}'. Returning None.")
-            return None 
+            logger.info("Fetched and cleaned text from %s (length: %d)", url, len(text))
+            text = text[:15000] # Limit content length to manage token usage (approx 4000-5000 tokens)
+            with _page_cache_lock:
+                _page_cache[url] = {'etag': etag, 'last_modified': last_modified, 'text': text,
+                                    'fetched_at': time.monotonic()}
+                _page_cache.move_to_end(url)
+                _page_cache_stats['misses'] += 1
+                while len(_page_cache) > PAGE_CACHE_MAXSIZE:
+                    _page_cache.popitem(last=False)
+            return text
+        return None
     except Exception as e: 
-        print(f"[{datetime.now()}] Error fetching or processing content from {url}: {e}")
+        logger.error("Error fetching or processing content from %s: %s", url, e)
         return None
 
-def get_urls_and_initial_info_from_ai(user_question):
+def normalize_url(url):
     """
-    Asks OpenAI to provide an initial answer/information and suggest relevant URLs
-    based on the user's question, with a strong emphasis on UK sources and an explanation if no URLs are found.
-    (Incorporates the reinforced prompt from Turn 54)
+    Canonical form of a URL for de-duplication and cache keys: lowercase scheme and host,
+    no fragment, no trailing slash, utm_* tracking parameters dropped and the rest sorted.
+    """
+    parts = urlsplit(url.strip())
+    query = '&'.join(sorted(param for param in parts.query.split('&') if param and not param.startswith('utm_')))
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path.rstrip('/') or '/', query, ''))
+
+def normalize_urls(urls):
+    """Normalizes urls and drops duplicates, keeping the first occurrence's position."""
+    return list(dict.fromkeys(normalize_url(url) for url in urls if isinstance(url, str) and url.strip()))
+
+# Worker threads for page fetches, so the URLs for one question are downloaded concurrently.
+# The pool size caps concurrent outbound fetches (prefetches included).
+MAX_URLS_TO_FETCH = 2
+_FETCH_EXECUTOR = ThreadPoolExecutor(max_workers=max(1, config.MAX_CONCURRENT_FETCHES), thread_name_prefix="fetch")
+atexit.register(_FETCH_EXECUTOR.shutdown, wait=False)
+
+def prefetch_urls(urls):
+    """Starts fetching urls in the background; returns {url: future} for fetch_urls_concurrently."""
+    return {url: _FETCH_EXECUTOR.submit(fetch_web_content, url) for url in urls}
+
+def fetch_urls_concurrently(urls, prefetched=None):
+    """
+    Fetches all urls in parallel and returns their contents (None for failures) in the same order.
+    URLs already started by prefetch_urls() are not fetched again.
+    """
+    prefetched = prefetched or {}
+    futures = [prefetched.get(url) or _FETCH_EXECUTOR.submit(fetch_web_content, url) for url in urls]
+    return [future.result() for future in futures]
+
+# One OpenAI client per process, so its HTTP connection pool is reused across calls.
+_openai_client = None
+
+def get_openai_client():
+    """Returns the shared OpenAI client, creating it on first use."""
+    global _openai_client
+    if _openai_client is None:
+        _openai_client = OpenAI(api_key=config.OPENAI_API_KEY)
+    return _openai_client
+
+def reset_openai_client():
+    """Closes and forgets the shared OpenAI client (e.g. after changing the API key)."""
+    global _openai_client
+    if _openai_client is not None:
+        _openai_client.close()
+        _openai_client = None
+
+atexit.register(reset_openai_client)
+
+# Question keywords: words of 3+ characters, minus common words that would match almost every stored enquiry.
+_WORD_RE = re.compile(r"[a-z][a-z0-9']{2,}")
+_STOPWORDS = frozenset({
+    'the', 'and', 'for', 'are', 'but', 'not', 'you', 'your', 'all', 'any', 'can', 'had', 'has', 'have',
+    'her', 'his', 'its', 'our', 'out', 'was', 'were', 'what', 'when', 'where', 'which', 'who', 'whom',
+    'why', 'how', 'with', 'this', 'that', 'these', 'those', 'from', 'into', 'about', 'does', 'did',
+    'doing', 'should', 'would', 'could', 'will', 'shall', 'there', 'their', 'them', 'they', 'then',
+    'than', 'been', 'being', 'also', 'some', 'such', 'only', 'own', 'same', 'very', 'just', 'get',
+    'tell', 'please', 'know', 'want', 'need', "i'm", "what's", 'mine', 'myself',
+})
+
+# Greetings and thanks are answered directly instead of going through caching, sourcing and synthesis.
+_SMALL_TALK_RE = re.compile(
+    r"(hi|hello|hey|hiya|good (morning|afternoon|evening)|thanks|thank you|thank you very much|thanks a lot|cheers|ok|okay|bye|goodbye)( there| again| so much)?[\s!.?,]*",
+    re.IGNORECASE)
+SMALL_TALK_REPLY = "Happy to help. Ask me a question about UK finance or tax, for example: 'What is the current Personal Allowance?'"
+
+def is_small_talk(user_question):
+    return _SMALL_TALK_RE.fullmatch(user_question.strip()) is not None
+
+def extract_keywords(user_question):
+    """Returns the distinct search keywords of a question, in order of first appearance."""
+    words = _WORD_RE.findall(user_question.lower())
+    return list(dict.fromkeys(w for w in words if w not in _STOPWORDS))
+
+# Token budget for the synthesis prompt (system + user message). Each fetched page is cut to
+# SYNTHESIS_MAX_TOKENS_PER_URL, and the combined content to whatever the fixed parts of the
+# prompt leave over.
+SYNTHESIS_MAX_INPUT_TOKENS = 8000
+SYNTHESIS_MAX_TOKENS_PER_URL = 3000
+_SYNTHESIS_TEMPLATE_TOKENS = 150 # Instructions and headers in the synthesis user prompt
+_CHARS_PER_TOKEN_ESTIMATE = 4 # Used when the tokenizer cannot be loaded
+_token_encoding = None
+_token_encoding_failed = False
+
+def _get_token_encoding():
+    """
+    Returns the cl100k_base tokenizer (used by the gpt-3.5/gpt-4 chat models), loading it once,
+    or None if it cannot be loaded (e.g. its BPE file cannot be downloaded).
+    """
+    global _token_encoding, _token_encoding_failed
+    if _token_encoding is None and not _token_encoding_failed:
+        try:
+            _token_encoding = tiktoken.get_encoding("cl100k_base")
+        except Exception as e:
+            _token_encoding_failed = True
+            logger.warning("Could not load tokenizer, estimating tokens from characters instead: %s", e)
+    return _token_encoding
+
+def count_tokens(text):
+    encoding = _get_token_encoding()
+    if encoding is None:
+        return len(text or "") // _CHARS_PER_TOKEN_ESTIMATE
+    return len(encoding.encode(text or ""))
+
+def truncate_to_tokens(text, max_tokens):
+    """Returns text cut down to at most max_tokens tokens."""
+    encoding = _get_token_encoding()
+    if encoding is None:
+        return text[:max(max_tokens, 0) * _CHARS_PER_TOKEN_ESTIMATE]
+    tokens = encoding.encode(text)
+    if len(tokens) <= max_tokens:
+        return text
+    return encoding.decode(tokens[:max(max_tokens, 0)])
+
+# Requests above this temperature are meant to vary, so they are never answered from cache.
+LLM_CACHE_MAX_TEMPERATURE = 0.7
+
+def cached_chat_completion(client, model, messages, temperature, response_format=None, stream_to=None):
+    """
+    Returns the message content of a chat completion. An identical request (same model,
+    messages, temperature and response_format) made within config.LLM_CACHE_TTL_SECONDS
+    is answered from the LLMResponseCache table instead of calling OpenAI again.
+    If stream_to (a text stream such as sys.stdout) is given, the content is also written
+    to it as it arrives.
     """
-    print(f"[{datetime.now()}] Asking OpenAI to find info and URLs for: '{user_question}'")
+    cache_key = None
+    if temperature <= LLM_CACHE_MAX_TEMPERATURE:
+        request_fingerprint = json.dumps(
+            {"model": model, "messages": messages, "temperature": temperature, "response_format": response_format},
+            sort_keys=True, ensure_ascii=False)
+        cache_key = hashlib.sha256(request_fingerprint.encode('utf-8')).hexdigest()
+        cached_content = database.get_cached_llm_response(cache_key, config.LLM_CACHE_TTL_SECONDS)
+        if cached_content is not None:
+            logger.info("Using cached %s response.", model)
+            if stream_to:
+                stream_to.write(cached_content)
+                stream_to.flush()
+            return cached_content
+
+    request_args = {"model": model, "messages": messages, "temperature": temperature}
+    if response_format:
+        request_args["response_format"] = response_format
+    if stream_to:
+        content_parts = []
+        for chunk in client.chat.completions.create(stream=True, **request_args):
+            delta = chunk.choices[0].delta.content if chunk.choices else None
+            if delta:
+                stream_to.write(delta)
+                stream_to.flush()
+                content_parts.append(delta)
+        content = "".join(content_parts)
+    else:
+        response = client.chat.completions.create(**request_args)
+        content = response.choices[0].message.content
+    if cache_key and content:
+        database.store_llm_response(cache_key, content)
+    return content
+
+# Paraphrased questions are matched against stored enquiries by embedding similarity:
+# a verified answer at or above SEMANTIC_CACHE_SIMILARITY_THRESHOLD is reused outright, and
+# the pages behind the URLs of an enquiry at or above GENERATIVE_CACHE_MIN_SIMILARITY are
+# given to synthesis in place of a fresh fetch.
+EMBEDDING_MODEL = "text-embedding-3-small"
+SEMANTIC_CACHE_SIMILARITY_THRESHOLD = 0.92
+GENERATIVE_CACHE_MIN_SIMILARITY = 0.75
+
+def get_question_embedding(user_question):
+    """Returns the embedding of the question as a list of floats, or None on failure."""
     if not config.OPENAI_API_KEY:
-        print(f"[{datetime.now()}] Error: OPENAI_API_KEY not configured.")
-        return {"answer": "OpenAI API key not configured.", "urls": [], "url_search_explanation": "Configuration error."}
+        return None
+    try:
+        client = get_openai_client()
+        response = client.embeddings.create(model=EMBEDDING_MODEL, input=user_question)
+        return response.data[0].embedding
+    except Exception as e:
+        logger.error("Error getting embedding for question: %s", e)
+        return None
+
+# Stored enquiries with their unit-length question embeddings, held in memory as one float32
+# matrix so a lookup is a single matrix-vector product rather than a database round trip.
+# Enquiries answered by this process are appended as they are recorded; every
+# EMBEDDING_INDEX_REFRESH_SECONDS only rows added by other processes (id > the highest id
+# loaded) are read, plus the current set of verified ids so later verifications are picked up.
+EMBEDDING_INDEX_REFRESH_SECONDS = 300
+_embedding_matrix = None # rows [0, _embedding_count) are in use
+_embedding_count = 0
+_embedding_enquiries = [] # enquiry dict for each matrix row
+_embedding_rows = {} # enquiry id -> matrix row
+_embedding_max_loaded_id = 0
+_embedding_index_refreshed_at = None
+_embedding_index_lock = threading.Lock()
+
+def _append_to_embedding_index(question_embedding, enquiry):
+    """Adds one enquiry to the matrix, growing it geometrically. Caller holds _embedding_index_lock."""
+    global _embedding_matrix, _embedding_count
+    if enquiry['id'] in _embedding_rows:
+        return
+    vector = np.asarray(question_embedding, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    if not norm:
+        return
+    if _embedding_matrix is None:
+        _embedding_matrix = np.empty((64, vector.shape[0]), dtype=np.float32)
+    elif _embedding_count == _embedding_matrix.shape[0]:
+        grown = np.empty((2 * _embedding_count, _embedding_matrix.shape[1]), dtype=np.float32)
+        grown[:_embedding_count] = _embedding_matrix
+        _embedding_matrix = grown
+    _embedding_matrix[_embedding_count] = vector / norm
+    _embedding_enquiries.append(enquiry)
+    _embedding_rows[enquiry['id']] = _embedding_count
+    _embedding_count += 1
+
+def _refresh_embedding_index():
+    """Loads enquiries added since the last refresh and syncs verification flags. Caller holds the lock."""
+    global _embedding_max_loaded_id, _embedding_index_refreshed_at
+    new_rows = database.get_enquiry_embeddings(after_id=_embedding_max_loaded_id)
+    for enquiry in new_rows:
+        _append_to_embedding_index(enquiry.pop('question_embedding'), enquiry)
+        _embedding_max_loaded_id = max(_embedding_max_loaded_id, enquiry['id'])
+    verified_ids = database.get_verified_embedding_ids()
+    newly_verified_ids = {enquiry['id'] for enquiry in _embedding_enquiries
+                          if enquiry['id'] in verified_ids and not enquiry['is_verified']}
+    for enquiry in _embedding_enquiries:
+        # A newly verified enquiry is only marked verified by its reload below.
+        enquiry['is_verified'] = enquiry['id'] in verified_ids and enquiry['id'] not in newly_verified_ids
+    # Enquiries verified since they were last seen are re-read, since an answer is often corrected
+    # before it is verified; older ones not yet loaded (e.g. without fetched content) are added.
+    newly_verified_ids |= verified_ids.difference(_embedding_rows)
+    if newly_verified_ids:
+        for enquiry in database.get_enquiry_embeddings(enquiry_ids=newly_verified_ids):
+            question_embedding = enquiry.pop('question_embedding')
+            row = _embedding_rows.get(enquiry['id'])
+            if row is None:
+                _append_to_embedding_index(question_embedding, enquiry)
+            else:
+                _embedding_enquiries[row] = enquiry
+    _embedding_index_refreshed_at = time.monotonic()
+    logger.info("Embedding index refreshed: %d new, %d newly verified, %d total.",
+                len(new_rows), len(newly_verified_ids), _embedding_count)
+
+def add_to_embedding_index(question_embedding, enquiry):
+    """Adds an enquiry answered by this process to the in-memory index."""
+    with _embedding_index_lock:
+        # Before the first load the enquiry will come from the database with everything else.
+        if _embedding_index_refreshed_at is not None:
+            _append_to_embedding_index(question_embedding, enquiry)
 
-    client = OpenAI(api_key=config.OPENAI_API_KEY)
-    system_prompt = """You are an AI assistant helping a user find financial information relevant to the UK.
+def find_similar_enquiries(question_embedding, limit=5):
+    """
+    Returns up to `limit` (similarity, enquiry) pairs with cosine similarity of at least
+    GENERATIVE_CACHE_MIN_SIMILARITY, most similar first.
+    """
+    query = np.asarray(question_embedding, dtype=np.float32)
+    norm = np.linalg.norm(query)
+    if not norm:
+        return []
+    with _embedding_index_lock:
+        if _embedding_index_refreshed_at is None or time.monotonic() - _embedding_index_refreshed_at > EMBEDDING_INDEX_REFRESH_SECONDS:
+            _refresh_embedding_index()
+        if not _embedding_count:
+            return []
+        similarities = _embedding_matrix[:_embedding_count] @ (query / norm)
+        candidates = np.flatnonzero(similarities >= GENERATIVE_CACHE_MIN_SIMILARITY)
+        if len(candidates) > limit:
+            candidates = candidates[np.argpartition(-similarities[candidates], limit)[:limit]]
+        candidates = candidates[np.argsort(-similarities[candidates])]
+        return [(float(similarities[row]), _embedding_enquiries[row]) for row in candidates]
+
+# Appended to every answer shown to the user.
+DISCLAIMER = "Disclaimer: This information is for guidance only and not professional financial advice. Please consult with a qualified financial advisor for advice tailored to your specific situation."
+
+# Prompts are built once at import; only the question-specific parts are filled in per call.
+# Keeping the static text first in each message lets OpenAI's prompt-prefix cache reuse it.
+SOURCING_SYSTEM_PROMPT = """You are an AI assistant helping a user find financial information relevant to the UK.
 Based on the user's question, you MUST provide a response as a single, valid JSON object.
 This JSON object should contain the following keys:
 1.  "answer": (String) A direct answer or summary of information related to the user's question if readily available from your knowledge.
@@ -65,61 +423,26 @@ Example of a response WITH URLs:
 Example of a response WITHOUT URLs:
 {"answer": "Diversification is key for long-term investment strategy.", "urls": [], "url_search_explanation": "The question about investment strategy is broad; specific official URLs are less applicable than general principles."}
 """
-    user_prompt = f"User question: \"{user_question}\"\n\nPlease provide your answer, relevant UK-specific URLs, and a URL search explanation in the specified JSON format."
-
-    try:
-        response = client.chat.completions.create(
-            model="gpt-3.5-turbo-0125", 
-            response_format={"type": "json_object"},
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt}
-            ],
-            temperature=0.2
-        )
-        
-        ai_response_content = response.choices[0].message.content
-        print(f"[{datetime.now()}] Received initial info, URLs, and explanation from OpenAI.")
-        
-        parsed_response = json.loads(ai_response_content)
-        
-        if 'answer' not in parsed_response: parsed_response['answer'] = "AI response structure was incomplete (missing answer)."
-        if 'urls' not in parsed_response or not isinstance(parsed_response['urls'], list):
-            parsed_response['urls'] = []
-            if 'url_search_explanation' not in parsed_response: 
-                 parsed_response['url_search_explanation'] = "AI response structure was incomplete (missing urls and explanation)."
-        if 'url_search_explanation' not in parsed_response:
-             parsed_response['url_search_explanation'] = "No explanation provided by AI for URL search."
-             
-        return parsed_response
-        
-    except json.JSONDecodeError as e:
-        print(f"[{datetime.now()}] Error: Failed to decode JSON response from AI (get_urls_and_initial_info_from_ai). Error: {e}")
-        ai_response_content_for_log = locals().get('ai_response_content', 'Not available')
-        print(f"AI Response Content was: {ai_response_content_for_log}")
-        return {"answer": "Sorry, I encountered an error parsing the AI's sourcing response.", "urls": [], "url_search_explanation": "JSON parsing error."}
-    except Exception as e:
-        print(f"[{datetime.now()}] Error getting initial info/URLs from OpenAI: {e}")
-        return {"answer": "Sorry, I encountered an error trying to find initial information.", "urls": [], "url_search_explanation": f"API or other error: {str(e)}"}
-
-def synthesize_final_answer_with_ai(user_question, initial_ai_answer, fetched_url_contents: list):
-    """
-    Synthesizes a final answer using initial AI info and content fetched from URLs.
-    """
-    print(f"[{datetime.now()}] Synthesizing final answer for: '{user_question}'")
-    if not config.OPENAI_API_KEY:
-        return "OpenAI API key not configured. Cannot synthesize final answer."
-
-    client = OpenAI(api_key=config.OPENAI_API_KEY)
-    
-    context_from_urls = "\n\n".join([f"Content from URL {i+1}:\n{content}" for i, content in enumerate(fetched_url_contents) if content])
-    if not context_from_urls.strip() and not fetched_url_contents: # No URLs were provided or all fetches failed
-        context_from_urls = "No additional content was successfully fetched from any identified URLs."
-    elif not context_from_urls.strip() and fetched_url_contents: # URLs provided, but all fetches returned empty/None
-        context_from_urls = "Content could not be fetched or was empty for the identified URLs."
+SOURCING_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "uk_finance_sourcing",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {
+                "answer": {"type": "string"},
+                "urls": {"type": "array", "items": {"type": "string"}},
+                "url_search_explanation": {"type": "string"},
+            },
+            "required": ["answer", "urls", "url_search_explanation"],
+            "additionalProperties": False,
+        },
+    },
+}
+SOURCING_USER_PROMPT_TEMPLATE = "User question: \"{user_question}\"\n\nPlease provide your answer, relevant UK-specific URLs, and a URL search explanation in the specified JSON format."
 
-
-    system_prompt = """You are 'FinanceAdvisor', a helpful AI assistant specializing in UK finance and tax matters.
+SYNTHESIS_SYSTEM_PROMPT = """You are 'FinanceAdvisor', a helpful AI assistant specializing in UK finance and tax matters.
 Your goal is to provide a comprehensive and accurate answer to the user's question.
 You have been provided with an initial AI-generated answer and content fetched from relevant URLs (if any).
 Integrate all this information to formulate your final response.
@@ -127,16 +450,16 @@ If the fetched content from URLs provides more specific or up-to-date details, p
 If the initial answer was good and the URL content doesn't add much new relevant information, you can reiterate or slightly expand on the initial answer, referencing that no further details were found in the provided URLs.
 If contradictions arise, try to highlight them or use your best judgment based on what seems most authoritative (e.g., content from .gov.uk URLs).
 Always be polite and professional.
-Crucially, end every response with the following disclaimer: 'Disclaimer: This information is for guidance only and not professional financial advice. Please consult with a qualified financial advisor for advice tailored to your specific situation.'"""
+Crucially, end every response with the following disclaimer: '""" + DISCLAIMER + "'"
 
-    user_prompt = f"""User question: "{user_question}"
+SYNTHESIS_USER_PROMPT_TEMPLATE = """User question: "{user_question}"
 
 Initial AI-generated information/answer:
 ---
 {initial_ai_answer}
 ---
 
-Content fetched from potentially relevant URLs (Note: if this section says "No additional content was successfully fetched...", it means either no URLs were provided to fetch, or fetching failed, or fetched content was empty):
+Content fetched from potentially relevant URLs:
 ---
 {context_from_urls}
 ---
@@ -144,30 +467,142 @@ Content fetched from potentially relevant URLs (Note: if this section says "No a
 Please synthesize a final, comprehensive answer to the user's question using all the provided information.
 Ensure the answer includes the mandatory disclaimer at the end.
 """
+
+def get_urls_and_initial_info_from_ai(user_question):
+    """
+    Asks OpenAI to provide an initial answer/information and suggest relevant URLs
+    based on the user's question, with a strong emphasis on UK sources and an explanation if no URLs are found.
+    (Incorporates the reinforced prompt from Turn 54)
+    "succeeded" is False when no usable response was obtained; "answer" then holds an error message.
+    """
+    logger.info("Asking OpenAI to find info and URLs for: '%s'", user_question)
+    if not config.OPENAI_API_KEY:
+        logger.error("OPENAI_API_KEY not configured.")
+        return {"answer": "OpenAI API key not configured.", "urls": [], "url_search_explanation": "Configuration error.", "succeeded": False}
+
+    client = get_openai_client()
+    user_prompt = SOURCING_USER_PROMPT_TEMPLATE.format_map({'user_question': user_question})
+
+    try:
+        ai_response_content = cached_chat_completion(
+            client,
+            model="gpt-4o-mini", # Supports strict structured outputs
+            response_format=SOURCING_RESPONSE_FORMAT,
+            messages=[
+                {"role": "system", "content": SOURCING_SYSTEM_PROMPT},
+                {"role": "user", "content": user_prompt}
+            ],
+            temperature=0.2
+        )
+        logger.info("Received initial info, URLs, and explanation from OpenAI.")
+        
+        # Strict structured outputs guarantee the keys and types declared in SOURCING_RESPONSE_FORMAT.
+        return {**json.loads(ai_response_content), "succeeded": True}
+        
+    except json.JSONDecodeError as e:
+        logger.error("Failed to decode JSON response from AI (get_urls_and_initial_info_from_ai). Error: %s", e)
+        ai_response_content_for_log = locals().get('ai_response_content', 'Not available')
+        logger.error("AI Response Content was: %s", ai_response_content_for_log)
+        return {"answer": "Sorry, I encountered an error parsing the AI's sourcing response.", "urls": [], "url_search_explanation": "JSON parsing error.", "succeeded": False}
+    except Exception as e:
+        logger.error("Error getting initial info/URLs from OpenAI: %s", e)
+        return {"answer": "Sorry, I encountered an error trying to find initial information.", "urls": [], "url_search_explanation": f"API or other error: {str(e)}", "succeeded": False}
+
+def add_disclaimer(answer):
+    """Returns answer with the mandatory disclaimer appended, unless it already contains it."""
+    if DISCLAIMER in answer:
+        return answer
+    return f"{answer}\n\n{DISCLAIMER}"
+
+def synthesize_final_answer_with_ai(user_question, initial_ai_answer, fetched_url_contents: list, stream_to=None,
+                                    initial_answer_ok=True):
+    """
+    Synthesizes a final answer using initial AI info and content fetched from URLs.
+    If stream_to is given, the answer (including any appended disclaimer) is written to it
+    as it is generated. initial_answer_ok is False when sourcing failed and initial_ai_answer
+    is only an error message.
+    """
+    logger.info("Synthesizing final answer for: '%s'", user_question)
+    if initial_answer_ok and not any(fetched_url_contents):
+        # Without URL content there is nothing to integrate, so the initial answer stands.
+        logger.info("No URL content to synthesize; returning the initial answer.")
+        answer = add_disclaimer(initial_ai_answer)
+        if stream_to:
+            stream_to.write(answer)
+        return answer
+    if not config.OPENAI_API_KEY:
+        message = "OpenAI API key not configured. Cannot synthesize final answer."
+        if stream_to:
+            stream_to.write(message)
+        return message
+
+    client = get_openai_client()
+    
     try:
-        print(f"[{datetime.now()}] Sending question and context to OpenAI for final answer synthesis...")
-        response = client.chat.completions.create(
+        # Each page gets its own share of the budget, so one long page cannot crowd out the others.
+        context_from_urls = "\n\n".join([f"Content from URL {i+1}:\n{truncate_to_tokens(content, SYNTHESIS_MAX_TOKENS_PER_URL)}"
+                                         for i, content in enumerate(fetched_url_contents) if content])
+
+        context_token_budget = SYNTHESIS_MAX_INPUT_TOKENS - _SYNTHESIS_TEMPLATE_TOKENS - (
+            count_tokens(SYNTHESIS_SYSTEM_PROMPT) + count_tokens(user_question) + count_tokens(initial_ai_answer))
+        context_from_urls = truncate_to_tokens(context_from_urls, context_token_budget)
+
+        user_prompt = SYNTHESIS_USER_PROMPT_TEMPLATE.format_map({
+            'user_question': user_question, 'initial_ai_answer': initial_ai_answer, 'context_from_urls': context_from_urls})
+        logger.info("Sending question and context to OpenAI for final answer synthesis...")
+        final_answer = cached_chat_completion(
+            client,
             model="gpt-4-turbo-preview", # Using a more capable model for synthesis
             messages=[
-                {"role": "system", "content": system_prompt},
+                {"role": "system", "content": SYNTHESIS_SYSTEM_PROMPT},
                 {"role": "user", "content": user_prompt}
             ],
-            temperature=0.5
+            temperature=0.5,
+            stream_to=stream_to
         )
-        final_answer = response.choices[0].message.content
-        disclaimer = "Disclaimer: This information is for guidance only and not professional financial advice. Please consult with a qualified financial advisor for advice tailored to your specific situation."
-        if disclaimer not in final_answer:
-            final_answer += f"\n\n{disclaimer}"
-        return final_answer
+        answer = add_disclaimer(final_answer)
+        if stream_to:
+            stream_to.write(answer[len(final_answer):])
+        return answer
     except Exception as e:
-        print(f"[{datetime.now()}] Error synthesizing final answer with OpenAI: {e}")
+        logger.error("Error synthesizing final answer with OpenAI: %s", e)
         # Fallback to initial answer if synthesis fails, but still add disclaimer
-        disclaimer = "Disclaimer: This information is for guidance only and not professional financial advice. Please consult with a qualified financial advisor for advice tailored to your specific situation."
-        error_message = f"I apologize, but I encountered an error while trying to generate a detailed answer. Based on initial information: {initial_ai_answer}"
-        if disclaimer not in error_message:
-             error_message += f"\n\n{disclaimer}"
+        error_message = add_disclaimer(f"I apologize, but I encountered an error while trying to generate a detailed answer. Based on initial information: {initial_ai_answer}")
+        if stream_to:
+            stream_to.write(f"\n{error_message}")
         return error_message
 
+# Enquiry logging runs on a single background thread, so answers are shown without waiting
+# for the database. One worker keeps the writes for a question in submission order.
+_DB_WRITE_EXECUTOR = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db-write")
+atexit.register(_DB_WRITE_EXECUTOR.shutdown, wait=True) # Runs before database's own atexit cleanup
+
+def _log_db_write_failure(future):
+    if not future.cancelled() and future.exception() is not None:
+        logger.error("Background enquiry write failed", exc_info=future.exception())
+
+def _submit_db_write(fn, *args, **kwargs):
+    """Queues fn on the enquiry-logging thread; an exception it raises is logged rather than lost."""
+    future = _DB_WRITE_EXECUTOR.submit(fn, *args, **kwargs)
+    future.add_done_callback(_log_db_write_failure)
+    return future
+
+def _record_answered_enquiry(pending_enquiry_future, question_embedding, **enquiry_fields):
+    """
+    Background job: updates the enquiry logged by pending_enquiry_future with its final answer
+    (inserting it if that initial write failed), then adds it to the embedding index.
+    """
+    # A failed initial write has already been logged by its own done-callback.
+    pending_enquiry_id = None if pending_enquiry_future.exception() else pending_enquiry_future.result()
+    enquiry_id = database.add_or_update_user_enquiry(enquiry_id=pending_enquiry_id,
+                                                     question_embedding=question_embedding, **enquiry_fields)
+    if enquiry_id and question_embedding and enquiry_fields.get('fetched_content_summary'):
+        add_to_embedding_index(question_embedding, {
+            'id': enquiry_id, 'question_text': enquiry_fields['question_text'],
+            'ai_generated_information': enquiry_fields['ai_generated_information'],
+            'ai_identified_urls': enquiry_fields['ai_identified_urls'],
+            'fetched_content_summary': enquiry_fields['fetched_content_summary'], 'is_verified': False})
+
 def handle_user_questions():
     """Handles user questions using AI for sourcing and synthesis, with caching."""
     print("\n--- Fiscal Advisor Q&A ---")
@@ -176,97 +611,158 @@ def handle_user_questions():
         try:
             user_question = input("Ask your finance question: ").strip()
             if user_question.lower() == 'quit':
+                logger.info("Page cache: %s", page_cache_info())
                 break
             if not user_question:
                 continue
 
-            print(f"[{datetime.now()}] Received question: '{user_question}'")
-            keywords = [kw.lower().strip('?,.') for kw in user_question.split() if len(kw.strip('?,.')) > 2]
-            print(f"[{datetime.now()}] Extracted keywords: {keywords}")
+            logger.info("Received question: '%s'", user_question)
+            if is_small_talk(user_question):
+                print(f"\nFinanceAdvisor says:\n{SMALL_TALK_REPLY}\n")
+                continue
+            keywords = extract_keywords(user_question)
+            logger.info("Extracted keywords: %s", keywords)
 
             cached_answer = None
+            cached_answer_record = None
             cached_enquiry_id = None
+            cache_hit_kind = None
             if keywords:
                 cached_enquiries = database.search_stored_enquiries(keywords, verified_only=True) # Prioritize verified
                 if cached_enquiries:
                     cached_answer_record = cached_enquiries[0]
-                    cached_answer = cached_answer_record['ai_generated_information']
-                    cached_enquiry_id = cached_answer_record['id']
-                    database.increment_enquiry_usage_count(cached_enquiry_id)
-                    print(f"[{datetime.now()}] Found verified cached answer (ID: {cached_enquiry_id}).")
+                    cache_hit_kind = "verified"
+                    logger.info("Found verified cached answer (ID: %s).", cached_answer_record['id'])
+
+            # Keyword miss: look for a verified answer to a paraphrase of this question.
+            question_embedding = None
+            similar_enquiries = []
+            if not cached_answer_record:
+                question_embedding = get_question_embedding(user_question)
+                if question_embedding:
+                    similar_enquiries = find_similar_enquiries(question_embedding)
+                for similarity, similar_enquiry in similar_enquiries:
+                    if similar_enquiry['is_verified'] and similarity >= SEMANTIC_CACHE_SIMILARITY_THRESHOLD:
+                        cached_answer_record = similar_enquiry
+                        cache_hit_kind = "semantic"
+                        logger.info("Found semantically similar verified answer (ID: %s, similarity: %.3f).", similar_enquiry['id'], similarity)
+                        break
+
+            if cached_answer_record:
+                cached_answer = cached_answer_record['ai_generated_information']
+                cached_enquiry_id = cached_answer_record['id']
+                database.increment_enquiry_usage_count(cached_enquiry_id)
             
             final_response_to_user = None
-            enquiry_id_for_this_session = None # ID for the current ask, even if cache is hit
+            answer_streamed = False
 
             if cached_answer:
                 final_response_to_user = cached_answer
-                source_of_answer_log = f"cache_hit_verified_enquiry_id_{cached_enquiry_id}"
+                source_of_answer_log = f"cache_hit_{cache_hit_kind}_enquiry_id_{cached_enquiry_id}"
                 # Log this specific instance of the question being answered from cache
-                enquiry_id_for_this_session = database.add_or_update_user_enquiry(
+                _submit_db_write(
+                    database.add_or_update_user_enquiry,
                     question_text=user_question, keywords=keywords,
                     ai_generated_information=cached_answer, # Store the cached answer
-                    ai_identified_urls=cached_enquiries[0].get('ai_identified_urls'), # Store URLs from cached entry if available
-                    source_of_answer=source_of_answer_log
+                    ai_identified_urls=cached_answer_record.get('ai_identified_urls'), # Store URLs from cached entry if available
+                    source_of_answer=source_of_answer_log,
+                    question_embedding=question_embedding
                 )
             else:
-                print(f"[{datetime.now()}] No suitable verified cached answer. Proceeding with live AI sourcing.")
-                # Log initial enquiry before potentially lengthy AI calls
-                enquiry_id_for_this_session = database.add_or_update_user_enquiry(question_text=user_question, keywords=keywords, source_of_answer="pending_ai_processing")
-                if not enquiry_id_for_this_session:
-                    print(f"[{datetime.now()}] Failed to log initial enquiry. Aborting Q&A for this question.")
-                    continue
+                logger.info("No suitable verified cached answer. Proceeding with live AI sourcing.")
+                # Log initial enquiry before potentially lengthy AI calls (in the background)
+                pending_enquiry_future = _submit_db_write(
+                    database.add_or_update_user_enquiry, question_text=user_question, keywords=keywords,
+                    source_of_answer="pending_ai_processing", question_embedding=question_embedding)
+
+                # The pages behind the nearest similar question's URLs stand in for a fresh fetch, so
+                # start fetching them (usually from _page_cache) while the sourcing call is in flight.
+                prefetched = {}
+                nearest_urls = next((enquiry['ai_identified_urls'] for _, enquiry in similar_enquiries
+                                     if enquiry['ai_identified_urls']), None)
+                if nearest_urls:
+                    prefetched = prefetch_urls(normalize_urls(nearest_urls)[:MAX_URLS_TO_FETCH])
 
                 ai_sourcing_result = get_urls_and_initial_info_from_ai(user_question)
                 initial_ai_answer = ai_sourcing_result.get("answer", "AI could not provide initial information.")
-                identified_urls = ai_sourcing_result.get("urls", [])
+                identified_urls = normalize_urls(ai_sourcing_result.get("urls", []))
                 url_search_explanation = ai_sourcing_result.get("url_search_explanation", "")
                 
-                print(f"[{datetime.now()}] Initial AI answer: {initial_ai_answer[:200]}...")
-                print(f"[{datetime.now()}] AI identified URLs: {identified_urls}")
+                logger.info("Initial AI answer: %s...", initial_ai_answer[:200])
+                logger.info("AI identified URLs: %s", identified_urls)
                 if not identified_urls and url_search_explanation:
-                    print(f"[{datetime.now()}] AI explanation for no URLs: {url_search_explanation}")
+                    logger.info("AI explanation for no URLs: %s", url_search_explanation)
 
+                # The similar question's pages are used in full; the suggested URLs are fetched only
+                # when none of those pages could be retrieved.
                 fetched_contents = []
-                if identified_urls:
-                    print(f"[{datetime.now()}] Attempting to fetch content from up to 2 identified URLs...")
-                    for url in identified_urls[:2]: 
-                        content = fetch_web_content(url)
+                reused_urls = []
+                if prefetched:
+                    prefetched_urls = list(prefetched)
+                    for url, content in zip(prefetched_urls, fetch_urls_concurrently(prefetched_urls, prefetched)):
+                        if content:
+                            fetched_contents.append(content)
+                            reused_urls.append(url)
+                    if reused_urls:
+                        logger.info("Reusing %d pages fetched for a similar enquiry instead of the suggested URLs.", len(reused_urls))
+                if not fetched_contents and identified_urls:
+                    urls_to_fetch = identified_urls[:MAX_URLS_TO_FETCH]
+                    logger.info("Attempting to fetch content from up to %d identified URLs...", MAX_URLS_TO_FETCH)
+                    for url, content in zip(urls_to_fetch, fetch_urls_concurrently(urls_to_fetch, prefetched)):
                         if content:
                             fetched_contents.append(content)
                         else:
-                            print(f"[{datetime.now()}] Failed to fetch content or content unsuitable from {url}")
+                            logger.warning("Failed to fetch content or content unsuitable from %s", url)
                 
-                fetched_content_summary_for_db = " ".join([c[:500]+"..." for c in fetched_contents]) if fetched_contents else None
+                if reused_urls:
+                    # This row gets no summary of its own (and stays out of the embedding index); its
+                    # URLs are the ones whose pages were actually used.
+                    fetched_content_summary_for_db = None
+                    urls_for_db = reused_urls
+                else:
+                    fetched_content_summary_for_db = " ".join([c[:500]+"..." for c in fetched_contents]) if fetched_contents else None
+                    urls_for_db = identified_urls
 
-                final_response_to_user = synthesize_final_answer_with_ai(user_question, initial_ai_answer, fetched_contents)
+                # The synthesised answer is printed as it streams in.
+                print("\nFinanceAdvisor says:")
+                final_response_to_user = synthesize_final_answer_with_ai(user_question, initial_ai_answer, fetched_contents,
+                                                                         stream_to=sys.stdout,
+                                                                         initial_answer_ok=ai_sourcing_result.get("succeeded", False))
+                answer_streamed = True
                 
-                source_of_answer_log = "live_ai_synthesis_with_url_content" if fetched_contents else "live_ai_synthesis_general_knowledge"
-                if not identified_urls and url_search_explanation != "Relevant URLs provided.": # If AI couldn't find URLs
-                    source_of_answer_log += "_no_urls_found_by_ai"
+                if reused_urls:
+                    source_of_answer_log = "generative_cache_reuse"
+                else:
+                    source_of_answer_log = "live_ai_synthesis_with_url_content" if fetched_contents else "live_ai_initial_answer_general_knowledge"
+                    if not identified_urls and url_search_explanation != "Relevant URLs provided.": # If AI couldn't find URLs
+                        source_of_answer_log += "_no_urls_found_by_ai"
 
-                database.add_or_update_user_enquiry(
-                    enquiry_id=enquiry_id_for_this_session, # Update the existing record for this session
+                _submit_db_write(
+                    _record_answered_enquiry, pending_enquiry_future, question_embedding,
                     question_text=user_question, keywords=keywords, # Resend question and keywords for completeness if updating
                     ai_generated_information=final_response_to_user,
-                    ai_identified_urls=identified_urls if identified_urls else None,
+                    ai_identified_urls=urls_for_db if urls_for_db else None,
                     fetched_content_summary=fetched_content_summary_for_db,
                     source_of_answer=source_of_answer_log,
                     is_verified=False 
                 )
 
-            print(f"\nFinanceAdvisor says:\n{final_response_to_user}\n")
+            if answer_streamed:
+                print("\n")
+            else:
+                print(f"\nFinanceAdvisor says:\n{final_response_to_user}\n")
 
         except Exception as e:
-            print(f"[{datetime.now()}] An error occurred in the Q&A loop: {e}")
-            import traceback
-            traceback.print_exc()
+            logger.exception("An error occurred in the Q&A loop: %s", e)
 
 # --- Main execution ---
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="[%(asctime)s] %(levelname)s %(name)s: %(message)s")
     print("Initializing UK Finance & Tax Law Fiscal Advisor...")
     
     print("Executing database schema (if needed)...")
     database.execute_schema() # This will create UserEnquiries if it doesn't exist
+    database.purge_expired_llm_responses()
     
     # No proactive monitoring agent or CSV source loading in this new approach
 
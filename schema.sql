@@ -18,5 +18,21 @@ CREATE TABLE IF NOT EXISTS UserEnquiries (
     source_of_answer VARCHAR(255)            -- e.g., 'live_ai_search_and_synthesis', 'cached_verified_response'
 );
 
+-- Embedding of question_text (text-embedding-3-small), used to match paraphrased questions
+ALTER TABLE UserEnquiries ADD COLUMN IF NOT EXISTS question_embedding REAL[];
+
 -- Optional: Index on keywords for faster searching of past enquiries
-CREATE INDEX IF NOT EXISTS idx_userenquiries_keywords ON UserEnquiries USING GIN (keywords);
\ No newline at end of file
+CREATE INDEX IF NOT EXISTS idx_userenquiries_keywords ON UserEnquiries USING GIN (keywords);
+
+-- Partial index for the hot verified-answer lookup (is_verified = TRUE AND keywords && ...)
+CREATE INDEX IF NOT EXISTS idx_userenquiries_keywords_verified ON UserEnquiries USING GIN (keywords) WHERE is_verified = TRUE;
+
+-- Exact-match cache of OpenAI chat completions, keyed by a hash of the full request
+CREATE TABLE IF NOT EXISTS LLMResponseCache (
+    cache_key CHAR(64) PRIMARY KEY,          -- sha256 of model, messages, temperature and response_format
+    response_content TEXT NOT NULL,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Lets the periodic expiry DELETE (created_at < now() - TTL) find old rows without a full scan
+CREATE INDEX IF NOT EXISTS idx_llmresponsecache_created_at ON LLMResponseCache (created_at);
\ No newline at end of file